@@ -0,0 +1,256 @@
+# api_server.py
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+from settings import BLOOMBERG_STYLE_DIR, API_HOST, API_PORT, API_CACHE_MAX_BYTES
+from compression import find_tsv, list_tsv_files, open_tsv
+
+PERIODS = ("annual", "quarterly")
+
+# Rows that hold labels rather than amounts, so they are served as strings
+TEXT_ROWS = {"12 Months Ending", "3 Months Ending", "FilingNumber"}
+
+
+def _parse_cell(text):
+    """Turn a table cell into a JSON value: None, int, float or the raw string."""
+    if text == "":
+        return None
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    if number != number:  # NaN
+        return None
+    if number.is_integer() and abs(number) < 2**53:
+        return int(number)
+    return number
+
+
+def load_table(path, ticker, period):
+    """
+    Parse one Bloomberg-style table into a dict ready for JSON:
+    {"ticker", "period", "columns", "rows": [{"metric", "values"}]}.
+    """
+    with open_tsv(path) as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader, [])
+        # Table layout: ticker, in_usd, then one column per period
+        columns = header[2:]
+        rows = []
+        for record in reader:
+            if len(record) < 2:
+                continue
+            metric = record[1]
+            cells = record[2:]
+            if metric in TEXT_ROWS:
+                values = [cell or None for cell in cells]
+            else:
+                values = [_parse_cell(cell) for cell in cells]
+            rows.append({"metric": metric, "values": values})
+    return {"ticker": ticker, "period": period, "columns": columns, "rows": rows}
+
+
+def is_valid_ticker(ticker):
+    """Tickers come from the URL, so refuse anything that could leave the tables directory."""
+    return bool(ticker) and not ticker.startswith(".") and not any(c in ticker for c in "/\\\0")
+
+
+def _entry_size(body, metric_rows):
+    """Approximate memory of a cache entry: its JSON plus the parsed rows."""
+    size = len(body) + sys.getsizeof(metric_rows)
+    for metric, values in metric_rows.items():
+        size += sys.getsizeof(metric) + sys.getsizeof(values)
+        size += sum(sys.getsizeof(value) for value in values)
+    return size
+
+
+class TableCache:
+    """
+    Thread-safe LRU cache of tables, holding each as its JSON body plus its
+    parsed rows by metric, and bounded by the memory of both.
+
+    Every lookup stats the file; a changed mtime, size or inode (as left by
+    transform_all_tickers' atomic rename) means the cached copy is stale and
+    the table is parsed again.
+    """
+
+    def __init__(self, tables_dir, max_bytes=API_CACHE_MAX_BYTES):
+        self.tables_dir = os.path.realpath(tables_dir)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (ticker, period) -> (signature, size, body, columns, metric_rows)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _table_path(self, ticker, period):
+        # SEC tickers are lower case, but let clients ask for AAPL as well
+        for name in dict.fromkeys((ticker, ticker.lower(), ticker.upper())):
+            path = find_tsv(self.tables_dir, f"{name}_{period}")
+            if os.path.exists(path):
+                return name, path
+        return ticker, path
+
+    def get(self, ticker, period):
+        """
+        Return (ticker, json_body, columns, metric_rows) or None if there is
+        no such table; `ticker` is spelled as in the file name.
+        """
+        if not is_valid_ticker(ticker):
+            return None
+        ticker, path = self._table_path(ticker, period)
+        if os.path.dirname(os.path.realpath(path)) != self.tables_dir:
+            return None
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._evict((ticker, period))
+            return None
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino, path)
+        key = (ticker, period)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                return (ticker,) + entry[2:]
+
+        # Parse outside the lock so other tickers are served meanwhile
+        table = load_table(path, ticker, period)
+        body = json.dumps(table, separators=(",", ":")).encode("utf-8")
+        metric_rows = {row["metric"]: row["values"] for row in table["rows"]}
+        size = _entry_size(body, metric_rows)
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (signature, size, body, table["columns"], metric_rows)
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[1]
+        return ticker, body, table["columns"], metric_rows
+
+    def _evict(self, key):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def tickers(self):
+        """Tickers that have at least one table on disk."""
+        names = list_tsv_files(self.tables_dir)
+        return sorted({name.rsplit("_", 1)[0] for name in names if name.rsplit("_", 1)[-1] in PERIODS})
+
+
+def metric_series(ticker, period, columns, metric_rows, metric):
+    """One metric as a time series, with each period's end date when known."""
+    values = metric_rows.get(metric)
+    if values is None:
+        return None
+    period_label = "12 Months Ending" if period == "annual" else "3 Months Ending"
+    period_ends = metric_rows.get(period_label, [None] * len(values))
+    return {
+        "ticker": ticker,
+        "period": period,
+        "metric": metric,
+        "series": [
+            {"column": column, "period_end": end, "value": value}
+            for column, end, value in zip(columns, period_ends, values)
+        ],
+    }
+
+
+class BloombergTableHandler(BaseHTTPRequestHandler):
+    """
+    Routes:
+      GET /tickers                              -> {"tickers": [...]}
+      GET /tickers/<ticker>/<annual|quarterly>  -> full table
+      GET /tickers/<ticker>/<period>/<metric>   -> one metric as a time series
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients skip a TCP handshake per request
+    # Headers and body go out in one buffered write with TCP_NODELAY; otherwise
+    # Nagle plus delayed ACK stalls every reused connection by ~40 ms
+    disable_nagle_algorithm = True
+    wbufsize = -1
+    cache = None  # set by serve()
+    verbose = False
+
+    def do_GET(self):
+        parts = [unquote(p) for p in urlsplit(self.path).path.split("/") if p]
+        if parts == ["tickers"]:
+            return self._send_json(200, {"tickers": self.cache.tickers()})
+
+        if len(parts) in (3, 4) and parts[0] == "tickers":
+            ticker, period = parts[1], parts[2].lower()
+            if not is_valid_ticker(ticker):
+                return self._send_json(400, {"error": f"Invalid ticker '{ticker}'"})
+            if period not in PERIODS:
+                return self._send_json(404, {"error": f"Unknown period '{period}', use annual or quarterly"})
+            cached = self.cache.get(ticker, period)
+            if cached is None:
+                return self._send_json(404, {"error": f"No {period} table for {ticker}"})
+            ticker, body, columns, metric_rows = cached
+            if len(parts) == 3:
+                return self._send_body(200, body)
+            series = metric_series(ticker, period, columns, metric_rows, parts[3])
+            if series is None:
+                return self._send_json(404, {"error": f"No metric '{parts[3]}' in {ticker} {period}"})
+            return self._send_json(200, series)
+
+        return self._send_json(404, {"error": "Not found"})
+
+    def _send_json(self, status, payload):
+        self._send_body(status, json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+
+    def _send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        # Per-request logging to stderr costs more than serving a cached table
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(tables_dir=BLOOMBERG_STYLE_DIR, host=API_HOST, port=API_PORT,
+          max_bytes=API_CACHE_MAX_BYTES, verbose=False):
+    """Serve the Bloomberg-style tables in `tables_dir` as JSON until interrupted."""
+    handler = type("Handler", (BloombergTableHandler,), {
+        "cache": TableCache(tables_dir, max_bytes),
+        "verbose": verbose,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"Serving tables from {tables_dir} on http://{host}:{port}/tickers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve Bloomberg-style tables as JSON.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--tables-dir", default=BLOOMBERG_STYLE_DIR)
+    parser.add_argument("--cache-mb", type=int, default=API_CACHE_MAX_BYTES // (1024 * 1024),
+                        help="upper bound on memory used by cached tables, in MB")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    args = parser.parse_args()
+    serve(args.tables_dir, args.host, args.port, args.cache_mb * 1024 * 1024, args.verbose)
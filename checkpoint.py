@@ -0,0 +1,90 @@
+# checkpoint.py
+
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+
+from compression import compressing_writer, compression_for, remove_other_variants
+
+STAGE_COMPLETE_SUFFIX = ".complete"
+TICKER_JOURNAL_SUFFIX = ".done"
+
+
+@contextmanager
+def atomic_write(path, mode="w", encoding="utf-8", newline=None, compress=True):
+    """
+    Open a temporary file next to `path` and move it into place only once the
+    block finishes without error, so readers never see a half-written file.
+    Paths ending in .gz or .zst are compressed on the way out, unless
+    compress=False (for bytes that are already encoded, e.g. a copied file).
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    # The ".part" suffix keeps leftovers from a crash out of *.tsv listings
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as raw:
+            stream = compressing_writer(raw, compression_for(path) if compress else None)
+            if "b" in mode:
+                f = stream
+            else:
+                f = io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+            yield f
+            if f is not stream:
+                f.detach()  # flushes the text layer without closing the stream
+            if stream is not raw:
+                stream.close()  # writes the compression trailer, leaves raw open
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        remove_other_variants(path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def clear_stage(checkpoint_dir, stage):
+    """Forget all recorded progress of `stage` so it runs again from scratch."""
+    for suffix in (STAGE_COMPLETE_SUFFIX, TICKER_JOURNAL_SUFFIX):
+        path = os.path.join(checkpoint_dir, stage + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def is_stage_complete(checkpoint_dir, stage):
+    """Return True if `stage` finished in a previous run."""
+    return os.path.exists(os.path.join(checkpoint_dir, stage + STAGE_COMPLETE_SUFFIX))
+
+
+def mark_stage_complete(checkpoint_dir, stage):
+    """Record that `stage` finished so a resumed run skips it entirely."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with atomic_write(os.path.join(checkpoint_dir, stage + STAGE_COMPLETE_SUFFIX)) as f:
+        f.write(stage + "\n")
+
+
+def completed_tickers(checkpoint_dir, stage):
+    """
+    Return the set of tickers already finished for `stage`.
+    A torn last line (crash mid-append) is ignored.
+    """
+    if checkpoint_dir is None:
+        return set()
+    journal = os.path.join(checkpoint_dir, stage + TICKER_JOURNAL_SUFFIX)
+    if not os.path.exists(journal):
+        return set()
+    with open(journal, "r", encoding="utf-8") as f:
+        return {line[:-1] for line in f if line.endswith("\n") and line[:-1]}
+
+
+def mark_ticker_complete(checkpoint_dir, stage, ticker):
+    """Append `ticker` to the journal of `stage` once its output is in place."""
+    if checkpoint_dir is None:
+        return
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    with open(os.path.join(checkpoint_dir, stage + TICKER_JOURNAL_SUFFIX), "a", encoding="utf-8") as f:
+        f.write(ticker + "\n")
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,140 @@
+# compression.py
+
+import gzip
+import io
+import os
+
+from settings import COMPRESSION_SUFFIXES, GZIP_LEVEL, ZSTD_LEVEL, ZSTD_THREADS
+
+try:
+    import zstandard
+except ImportError:  # only needed when an artifact is set to "zstd"
+    zstandard = None
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("zstd compression needs the 'zstandard' package: pip install zstandard")
+
+
+def compression_for(path):
+    """Infer the compression of `path` from its suffix (None for plain files)."""
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if suffix and path.endswith(suffix):
+            return compression
+    return None
+
+
+def with_compression(path, compression):
+    """Append the suffix of `compression` to a plain path, e.g. 'AAPL.tsv' -> 'AAPL.tsv.zst'."""
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(
+            f"Unknown compression {compression!r}, expected one of {list(COMPRESSION_SUFFIXES)}"
+        )
+    return path + COMPRESSION_SUFFIXES[compression]
+
+
+def strip_compression(path):
+    """Remove a compression suffix, e.g. 'AAPL.tsv.gz' -> 'AAPL.tsv'."""
+    suffix = COMPRESSION_SUFFIXES[compression_for(path)]
+    return path[:-len(suffix)] if suffix else path
+
+
+def is_tsv(filename):
+    """True for .tsv files, compressed or not."""
+    return strip_compression(filename).lower().endswith(".tsv")
+
+
+def list_tsv_files(directory):
+    """Map each TSV in `directory` from its name without '.tsv[.gz|.zst]' to its file name."""
+    files = {}
+    for filename in sorted(os.listdir(directory)):
+        if is_tsv(filename):
+            files[strip_compression(filename)[:-4]] = filename
+    return files
+
+
+def list_ticker_files(directory, tickers=None):
+    """
+    list_tsv_files() limited to `tickers` (None = all). Tickers match
+    case-insensitively, since SEC's ticker files are lower case but tickers
+    are usually typed upper case. Prints a warning for requested tickers
+    that have no file in `directory`.
+    """
+    files = list_tsv_files(directory)
+    if tickers is None:
+        return files
+    wanted = {t.lower() for t in tickers}
+    selected = {name: f for name, f in files.items() if name.lower() in wanted}
+    missing = wanted - {name.lower() for name in selected}
+    if missing:
+        print(f"Warning: no file in {directory} for tickers: {', '.join(sorted(missing))}")
+    return selected
+
+
+def find_tsv(directory, name):
+    """
+    Path of `name`.tsv in `directory` in whichever compression it was written.
+    Falls back to the plain .tsv path so a missing file still fails clearly.
+    """
+    plain = os.path.join(directory, f"{name}.tsv")
+    for compression in COMPRESSION_SUFFIXES:
+        path = with_compression(plain, compression)
+        if os.path.exists(path):
+            return path
+    return plain
+
+
+def open_tsv(path, mode="r", encoding="utf-8", newline=""):
+    """
+    Open a (possibly compressed) text file for 'r', 'w' or 'a'. Compression is
+    picked from the suffix. Appending to .gz/.zst adds a new member/frame,
+    which is read back transparently.
+    """
+    compression = compression_for(path)
+    if compression is None:
+        return open(path, mode, encoding=encoding, newline=newline)
+    if compression == "gzip":
+        return gzip.open(path, mode + "t", compresslevel=GZIP_LEVEL, encoding=encoding, newline=newline)
+
+    _require_zstandard()
+    raw = open(path, mode + "b")
+    if mode == "r":
+        stream = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+    else:
+        cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS)
+        stream = cctx.stream_writer(raw, closefd=True)
+    return io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+
+
+def compressing_writer(raw, compression):
+    """
+    Wrap the binary file `raw` in a compressor. Closing the compressor writes
+    its trailer but leaves `raw` open; with no compression `raw` is returned.
+    zstd compresses on ZSTD_THREADS background threads while data streams in.
+    """
+    if compression is None:
+        return raw
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL)
+    _require_zstandard()
+    cctx = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=ZSTD_THREADS)
+    return cctx.stream_writer(raw, closefd=False)
+
+
+def remove_other_variants(path):
+    """Delete copies of `path` left in a different compression by earlier runs."""
+    plain = strip_compression(path)
+    for compression in COMPRESSION_SUFFIXES:
+        other = with_compression(plain, compression)
+        if other != path and os.path.exists(other):
+            os.remove(other)
+
+
+def remove_all_variants(path):
+    """Delete `path` in every compression, e.g. an output that is no longer produced."""
+    plain = strip_compression(path)
+    for compression in COMPRESSION_SUFFIXES:
+        other = with_compression(plain, compression)
+        if os.path.exists(other):
+            os.remove(other)
@@ -5,32 +5,106 @@ import pandas as pd
 from pathlib import Path
 from tqdm import tqdm
 
-def transform_all_tickers(input_dir, output_dir):
+from checkpoint import atomic_write, completed_tickers, mark_ticker_complete
+from compression import open_tsv, list_ticker_files, remove_all_variants, with_compression
+from profiling import ticker_cost
+
+CHECKPOINT_STAGE = "pivot"
+
+DEFAULT_FYE = "1231"
+
+
+def _month_end(year, month, day):
+    """
+    Round dates to the nearest month end, as SEC does for ddate: a date in the
+    first half of a month counts as the end of the month before.
+    """
+    early = day <= 15
+    month = month.where(~early, month - 1)
+    year = year.where(month != 0, year - 1)
+    month = month.where(month != 0, 12)
+    return year, month
+
+
+def add_fiscal_periods(df):
+    """
+    Add 'fiscal_year' and 'fiscal_quarter' to each row from its numeric
+    'ddate' and the mmdd fiscal year end 'fye' of its filing (Dec 31 when
+    unknown). A fiscal year is named after the calendar year it ends in, so a
+    Sep year end puts Oct-Dec 2020 in q1_2021, and a year ending Jan 2, 2021
+    is fiscal 2020.
+    """
+    ddate = df["ddate"].astype("int64")
+    period_year, period_month = _month_end(ddate // 10000, ddate // 100 % 100, ddate % 100)
+
+    fye = df["fye"] if "fye" in df.columns else pd.Series(DEFAULT_FYE, index=df.index)
+    fye = pd.to_numeric(fye, errors="coerce").fillna(int(DEFAULT_FYE)).astype("int64")
+    _, fye_month = _month_end(pd.Series(0, index=df.index), fye // 100, fye % 100)
+    fye_month = fye_month.where(fye_month.between(1, 12), 12)
+
+    df = df.copy()
+    df["fiscal_year"] = period_year + (period_month > fye_month).astype("int64")
+    df["fiscal_quarter"] = (period_month - fye_month - 1) % 12 // 3 + 1
+    return df
+
+
+def fiscal_window_ddates(start_year=None, end_year=None):
+    """
+    ddate bounds (inclusive, None = open) that surely hold every period of
+    fiscal years start_year..end_year whatever the fiscal year end, for
+    dropping older facts when the data is first read.
+    """
+    min_ddate = (start_year - 1) * 10000 + 101 if start_year is not None else None
+    max_ddate = (end_year + 1) * 10000 + 115 if end_year is not None else None
+    return min_ddate, max_ddate
+
+
+def transform_all_tickers(input_dir, output_dir, tickers=None, checkpoint_dir=None, resume=False,
+                          compression=None, start_year=None, end_year=None, profile_dir=None):
     """
     Read every .tsv in `input_dir`, transform, and save resulting
     annual and quarterly .tsv files in `output_dir` with columns
     that match the new DB schema.
+    Only `tickers` are processed if given. Finished tickers are recorded in
+    checkpoint_dir, and with resume=True the ones already recorded are skipped.
+    Tables are written with the given `compression` and only hold fiscal
+    years start_year..end_year (None = no limit). Each ticker's cost is
+    recorded, and profiled into `profile_dir` if given.
     """
     # Ensure output_dir exists
     Path(output_dir).mkdir(parents=True, exist_ok=True)
 
     # Gather the TSV filenames we want to process
-    tsv_files = [f for f in os.listdir(input_dir) if f.lower().endswith(".tsv")]
+    done = completed_tickers(checkpoint_dir, CHECKPOINT_STAGE) if resume else set()
+    tsv_files = {
+        ticker: filename for ticker, filename in list_ticker_files(input_dir, tickers).items()
+        if ticker not in done
+    }
 
-    for filename in tqdm(tsv_files, desc="Processing TSV files", unit="file"):
+    for ticker_name, filename in tqdm(tsv_files.items(), desc="Processing TSV files", unit="file"):
         input_path = os.path.join(input_dir, filename)
-        ticker_name = os.path.splitext(filename)[0]
-        
-        process_single_ticker_tsv(input_path, output_dir, ticker_name)
 
+        with ticker_cost(CHECKPOINT_STAGE, ticker_name, profile_dir) as cost:
+            cost["rows"] = process_single_ticker_tsv(input_path, output_dir, ticker_name,
+                                                     compression=compression,
+                                                     start_year=start_year, end_year=end_year)
+        mark_ticker_complete(checkpoint_dir, CHECKPOINT_STAGE, ticker_name)
 
-def process_single_ticker_tsv(input_path, output_dir, ticker):
+
+def process_single_ticker_tsv(input_path, output_dir, ticker, compression=None,
+                              start_year=None, end_year=None):
     """
-    Read one ticker's TSV file, drop duplicates, split into annual (qtrs=4)
-    and quarterly (qtrs=1) data (plus qtrs=0 rows), pivot, and save results
-    with underscore-lowercase column names.
+    Read one ticker's TSV file (already de-duplicated by merge_num_and_sub),
+    split into annual (qtrs=4) and quarterly (qtrs=1) data (plus qtrs=0 rows),
+    pivot, and save results with underscore-lowercase column names.
+    Columns are labelled by fiscal period (fy_2021, q1_2021) and only exist
+    for periods in the data between start_year and end_year. A table with no
+    data in that window is deleted rather than left over from an earlier run.
+    Returns the number of rows read.
     """
-    df = pd.read_csv(input_path, sep="\t", dtype=str).drop_duplicates()
+    with open_tsv(input_path) as in_f:
+        df = pd.read_csv(in_f, sep="\t", dtype=str)
+    rows_read = len(df)
 
     # Convert relevant columns
     for col in ["qtrs", "ddate", "filed"]:
@@ -43,42 +117,17 @@ def process_single_ticker_tsv(input_path, output_dir, ticker):
     else:
         df["price"] = float('nan')
 
-    # Helper mappings
-    def map_annual_col(ddate):
-        """
-        Given an integer ddate like 20200930, return 'fy_2020', 'fy_2021', etc.
-        only if year is in 2020..2025.
-        """
-        year_str = str(ddate)[:4]
-        if year_str in ["2020", "2021", "2022", "2023", "2024", "2025"]:
-            return f"fy_{year_str}"
-        return None
+    # Order by filing date so pivot_table(aggfunc="first") always keeps the
+    # value as first reported, never a later restatement
+    df = df.sort_values(by=["filed", "adsh"], kind="mergesort")
 
-    def map_quarter_col(ddate):
-        """
-        Given an integer ddate like 20210331, return 'q1_2021', 'q2_2021', etc.,
-        only if year in 2020..2025.
-        """
-        year_str = str(ddate)[:4]
-        if year_str not in ["2020", "2021", "2022", "2023", "2024", "2025"]:
-            return None
-
-        month_str = str(ddate)[4:6]
-        try:
-            month = int(month_str)
-        except ValueError:
-            return None
-
-        if 1 <= month <= 3:
-            q = 1
-        elif 4 <= month <= 6:
-            q = 2
-        elif 7 <= month <= 9:
-            q = 3
-        else:
-            q = 4
-
-        return f"q{q}_{year_str}"
+    # Fiscal year/quarter of every row, from its ddate and its filing's fye
+    df = df[df["ddate"].notna()]
+    df = add_fiscal_periods(df)
+    if start_year is not None:
+        df = df[df["fiscal_year"] >= start_year]
+    if end_year is not None:
+        df = df[df["fiscal_year"] <= end_year]
 
     def find_earliest_adsh_for_ddate(subset_df, ddate):
         """
@@ -90,16 +139,19 @@ def process_single_ticker_tsv(input_path, output_dir, ticker):
         earliest = candidates.sort_values(by="filed", ascending=True).iloc[0]
         return earliest["adsh"] if pd.notnull(earliest["adsh"]) else ""
 
-    def build_pivot_table(subset_df, col_namer, desired_columns, period_label, ticker_name):
+    def build_pivot_table(subset_df, period_label, ticker_name):
         """
-        1) Determine which column each row belongs in via col_namer().
-        2) Pivot by 'tag' -> col_name, filling with 'value'.
-        3) Insert special rows for 'period_label', 'FilingNumber', and 'SharePriceAfterFiledDate'.
-        4) Reorder pivot's rows and columns, add 'ticker' column.
+        1) Pivot by 'tag' -> col_name, filling with 'value'.
+        2) Insert special rows for 'period_label', 'FilingNumber', and 'SharePriceAfterFiledDate'.
+        3) Reorder pivot's rows, and its columns oldest period first; only
+           periods present in the data get a column.
+        4) Add 'ticker' column.
         """
-        subset_df = subset_df.copy()
-        subset_df["col_name"] = subset_df["ddate"].apply(col_namer)
-        subset_df = subset_df[subset_df["col_name"].notna()]
+        desired_columns = (
+            subset_df.drop_duplicates("col_name")
+            .sort_values("col_order", kind="mergesort")["col_name"]
+            .tolist()
+        )
 
         pivot = subset_df.pivot_table(
             index="tag",
@@ -172,17 +224,19 @@ def process_single_ticker_tsv(input_path, output_dir, ticker):
         ((df["qtrs"] == 0) & (df["ddate"].isin(annual_ddates)))
     ].copy()
 
-    if not annual_df.empty:
-        annual_cols = [f"fy_{yr}" for yr in ["2020", "2021", "2022", "2023", "2024", "2025"]]
+    annual_outfile = with_compression(os.path.join(output_dir, f"{ticker}_annual.tsv"), compression)
+    if annual_df.empty:
+        remove_all_variants(annual_outfile)
+    else:
+        annual_df["col_name"] = "fy_" + annual_df["fiscal_year"].astype(str)
+        annual_df["col_order"] = annual_df["fiscal_year"]
         annual_pivot = build_pivot_table(
             annual_df,
-            map_annual_col,
-            annual_cols,
             period_label="12 Months Ending",
             ticker_name=ticker
         )
-        annual_outfile = os.path.join(output_dir, f"{ticker}_annual.tsv")
-        annual_pivot.to_csv(annual_outfile, sep="\t", index=False)
+        with atomic_write(annual_outfile, newline='') as out_f:
+            annual_pivot.to_csv(out_f, sep="\t", index=False)
 
     # -------------------------
     # QUARTERLY FILE (qtrs=1 + qtrs=0)
@@ -193,19 +247,20 @@ def process_single_ticker_tsv(input_path, output_dir, ticker):
         ((df["qtrs"] == 0) & (df["ddate"].isin(quarterly_ddates)))
     ].copy()
 
-    if not quarterly_df.empty:
-        qtr_cols = []
-        for y in ["2020", "2021", "2022", "2023", "2024", "2025"]:
-            for q in [1, 2, 3, 4]:
-                qtr_cols.append(f"q{q}_{y}")
-        
+    quarterly_outfile = with_compression(os.path.join(output_dir, f"{ticker}_quarterly.tsv"), compression)
+    if quarterly_df.empty:
+        remove_all_variants(quarterly_outfile)
+    else:
+        quarterly_df["col_name"] = (
+            "q" + quarterly_df["fiscal_quarter"].astype(str) + "_" + quarterly_df["fiscal_year"].astype(str)
+        )
+        quarterly_df["col_order"] = quarterly_df["fiscal_year"] * 10 + quarterly_df["fiscal_quarter"]
         quarterly_pivot = build_pivot_table(
             quarterly_df,
-            map_quarter_col,
-            qtr_cols,
             period_label="3 Months Ending",
             ticker_name=ticker
         )
-        quarterly_outfile = os.path.join(output_dir, f"{ticker}_quarterly.tsv")
-        quarterly_pivot.to_csv(quarterly_outfile, sep="\t", index=False)
+        with atomic_write(quarterly_outfile, newline='') as out_f:
+            quarterly_pivot.to_csv(out_f, sep="\t", index=False)
 
+    return rows_read
@@ -0,0 +1,116 @@
+# data_point_in_time.py
+
+import bisect
+import pandas as pd
+from tqdm import tqdm
+
+from checkpoint import atomic_write
+from compression import open_tsv
+
+INDEX_KEY = ["ticker", "tag", "ddate", "qtrs"]
+INDEX_COLUMNS = INDEX_KEY + ["filed", "adsh", "value"]
+
+
+def _one_row_per_filing(df):
+    """Sort by key and filing, keeping the lowest adsh of each (key, filed) pair."""
+    # Sort deterministically so ties on 'filed' always resolve the same way
+    df = df.sort_values(INDEX_KEY + ["filed", "adsh"], kind="mergesort")
+    return df.drop_duplicates(subset=INDEX_KEY + ["filed"], keep="first")
+
+
+def build_point_in_time_index(updated_num_file, output_file, chunk_size=10**5, compact_every=32):
+    """
+    Build an as-first-reported fact index from the merged num/sub file.
+
+    Every (ticker, tag, ddate, qtrs) key keeps one row per distinct reported
+    value, ordered by 'filed' date, so restatements appear as later rows and
+    repeated comparatives collapse into the filing that first reported them.
+    Only non-dimensional facts (dimn == 0) are indexed, since segment facts
+    share the same key.
+
+    The file is read `chunk_size` rows at a time and each chunk is cut down
+    to one row per (key, filing date) before it is kept, and the kept rows
+    are folded together every `compact_every` chunks. Repeated values can
+    only be collapsed once every filing of a key is known, so memory still
+    grows with the number of (key, filing date) pairs, roughly 250 bytes each.
+    """
+    parts = []
+    with open_tsv(updated_num_file) as in_f:
+        reader = pd.read_csv(in_f, sep='\t', dtype=str, chunksize=chunk_size)
+        for i, chunk in enumerate(tqdm(reader, desc="Building point-in-time index", unit="chunk"), start=1):
+            if "dimn" in chunk.columns:
+                chunk = chunk[pd.to_numeric(chunk["dimn"], errors="coerce").fillna(0) == 0]
+            chunk = chunk[INDEX_COLUMNS].copy()
+            for col in ["ddate", "qtrs", "filed"]:
+                chunk[col] = pd.to_numeric(chunk[col], errors="coerce")
+            chunk["value"] = pd.to_numeric(chunk["value"], errors="coerce")
+            chunk = chunk.dropna(subset=INDEX_KEY + ["filed", "value"])
+            for col in ["ddate", "qtrs", "filed"]:
+                chunk[col] = chunk[col].astype("int64")
+            parts.append(_one_row_per_filing(chunk))
+            if i % compact_every == 0:  # fold keys repeated across chunks as we go
+                parts = [_one_row_per_filing(pd.concat(parts, ignore_index=True))]
+
+    if parts:
+        df = _one_row_per_filing(pd.concat(parts, ignore_index=True))
+    else:
+        df = pd.DataFrame(columns=INDEX_COLUMNS)
+
+    # Drop values that merely repeat what was already known (comparatives in
+    # later 10-Q/10-K filings)
+    same_key = (df[INDEX_KEY] == df[INDEX_KEY].shift()).all(axis=1)
+    df = df[~(same_key & (df["value"] == df["value"].shift()))]
+
+    with atomic_write(output_file, newline='') as out_f:
+        df.to_csv(out_f, sep='\t', index=False)
+    print(f"Point-in-time index ({len(df)} facts) saved to: {output_file}")
+
+
+def load_point_in_time_index(index_file):
+    """
+    Load an index written by build_point_in_time_index() into memory.
+
+    Returns a dict of (ticker, tag, ddate, qtrs) -> (filed_dates, values, adshs),
+    three parallel lists sorted by filed date, ready for fact_as_of() lookups.
+    """
+    with open_tsv(index_file) as in_f:
+        df = pd.read_csv(
+            in_f,
+            sep='\t',
+            dtype={"ticker": str, "tag": str, "ddate": int, "qtrs": int,
+                   "filed": int, "adsh": str, "value": float}
+        )
+    index = {}
+    for row in df.itertuples(index=False):
+        key = (row.ticker, row.tag, row.ddate, row.qtrs)
+        entry = index.get(key)
+        if entry is None:
+            entry = index[key] = ([], [], [])
+        entry[0].append(row.filed)
+        entry[1].append(row.value)
+        entry[2].append(row.adsh)
+    return index
+
+
+def fact_as_of(index, ticker, tag, ddate, qtrs, as_of):
+    """
+    Return (value, filed, adsh) for the latest value of a fact that had been
+    filed on or before `as_of` (YYYYMMDD int), or None if nothing was known yet.
+    """
+    entry = index.get((ticker, tag, int(ddate), int(qtrs)))
+    if entry is None:
+        return None
+    filed_dates, values, adshs = entry
+    pos = bisect.bisect_right(filed_dates, int(as_of))
+    if pos == 0:
+        return None
+    return values[pos - 1], filed_dates[pos - 1], adshs[pos - 1]
+
+
+def first_reported(index, ticker, tag, ddate, qtrs):
+    """Return (value, filed, adsh) as the fact was first reported, or None."""
+    entry = index.get((ticker, tag, int(ddate), int(qtrs)))
+    if entry is None:
+        return None
+    filed_dates, values, adshs = entry
+    return values[0], filed_dates[0], adshs[0]
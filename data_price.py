@@ -6,53 +6,86 @@ import pandas as pd
 from tqdm import tqdm
 from loguru import logger
 
+from checkpoint import atomic_write, completed_tickers, mark_ticker_complete
+from compression import open_tsv, list_ticker_files, with_compression
 from oauth import get_bearer_token, get_price_for_date
+from profiling import ticker_cost
 
+CHECKPOINT_STAGE = "price"
 
-def add_price_to_files(input_dir, output_dir):
+
+def add_price_to_files(input_dir, output_dir, tickers=None, checkpoint_dir=None, resume=False,
+                       compression=None, profile_dir=None):
     """
     For each ticker file in input_dir, look up the price for the day after 'filed'
     date and write a new file with a 'price' column to output_dir.
+    Only `tickers` are processed if given. Finished tickers are recorded in
+    checkpoint_dir, and with resume=True the ones already recorded are skipped.
+    Output files are written with the given `compression`. Each ticker's
+    cost is recorded, and profiled into `profile_dir` if given.
     """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    tsv_files = sorted([f for f in os.listdir(input_dir) if f.lower().endswith('.tsv')])
+    done = completed_tickers(checkpoint_dir, CHECKPOINT_STAGE) if resume else set()
+    tsv_files = {
+        ticker: filename for ticker, filename in list_ticker_files(input_dir, tickers).items()
+        if ticker not in done
+    }
+    if done:
+        print(f"Resuming: {len(done)} ticker files already have prices")
 
     # Count total rows for progress bar
     total_rows = 0
-    for f in tsv_files:
+    for f in tsv_files.values():
         in_path = os.path.join(input_dir, f)
         try:
-            df = pd.read_csv(in_path, sep='\t', low_memory=False)
+            with open_tsv(in_path) as in_f:
+                df = pd.read_csv(in_f, sep='\t', low_memory=False)
             total_rows += len(df)
         except Exception:
             continue
 
     with tqdm(total=total_rows, desc="Adding price to ticker files") as pbar:
-        for file in tsv_files:
-            ticker = file[:-4]  # remove .tsv
+        for ticker, file in tsv_files.items():
             in_path = os.path.join(input_dir, file)
-            out_path = os.path.join(output_dir, file)
-            df = pd.read_csv(in_path, sep='\t')
-            if 'filed' not in df.columns:
-                logger.warning(f"Skipping {file}: no 'filed' column found.")
-                pbar.update(len(df))
-                continue
-
-            unique_dates = df['filed'].unique()
-            price_map = {}
-            for date_str in unique_dates:
-                # Convert filed date (YYYYMMDD) to datetime + 1 day
-                try:
-                    date_dt = datetime.datetime.strptime(str(date_str), "%Y%m%d") + datetime.timedelta(days=1)
-                    price_map[date_str] = get_price_for_date(ticker, date_dt)
-                except Exception as e:
-                    price_map[date_str] = None
-                    logger.error(f"Error fetching price for {ticker} on {date_str}: {e}")
-
-            df['price'] = df['filed'].map(price_map)
-            df.to_csv(out_path, sep='\t', index=False)
-            pbar.update(len(df))
+            out_path = with_compression(os.path.join(output_dir, f"{ticker}.tsv"), compression)
+            with ticker_cost(CHECKPOINT_STAGE, ticker, profile_dir) as cost:
+                rows = cost["rows"] = add_price_to_file(in_path, out_path, ticker)
+            mark_ticker_complete(checkpoint_dir, CHECKPOINT_STAGE, ticker)
+            pbar.update(rows)
 
     print(f"Ticker files with price added saved to: {output_dir}")
+
+
+def add_price_to_file(in_path, out_path, ticker):
+    """
+    Add a 'price' column (close on the day after 'filed') to one ticker file
+    and write it to out_path. Returns the number of rows read.
+    Raises requests' exceptions when the API cannot be reached, rather than
+    writing the file with missing prices.
+    """
+    with open_tsv(in_path) as in_f:
+        df = pd.read_csv(in_f, sep='\t')
+    if 'filed' not in df.columns:
+        logger.warning(f"Skipping {os.path.basename(in_path)}: no 'filed' column found.")
+        return len(df)
+
+    unique_dates = df['filed'].unique()
+    price_map = {}
+    for date_str in unique_dates:
+        # Convert filed date (YYYYMMDD) to datetime + 1 day
+        try:
+            date_dt = datetime.datetime.strptime(str(date_str), "%Y%m%d") + datetime.timedelta(days=1)
+        except ValueError as e:
+            price_map[date_str] = None
+            logger.error(f"Error fetching price for {ticker} on {date_str}: {e}")
+            continue
+        # Network and token errors propagate, so the ticker is not marked
+        # complete and --resume prices it again
+        price_map[date_str] = get_price_for_date(ticker, date_dt)
+
+    df['price'] = df['filed'].map(price_map)
+    with atomic_write(out_path, newline='') as out_f:
+        df.to_csv(out_f, sep='\t', index=False)
+    return len(df)
@@ -4,45 +4,73 @@ import os
 import pandas as pd
 from tqdm import tqdm
 
-def simplify_ticker_files(input_dir, output_dir):
+from checkpoint import atomic_write, completed_tickers, mark_ticker_complete
+from compression import open_tsv, list_ticker_files, with_compression
+from profiling import ticker_cost
+
+CHECKPOINT_STAGE = "simplify"
+
+SELECTED_COLUMNS = [
+    "ticker", "form", "cik", "adsh", "tag",
+    "ddate", "qtrs", "value", "dimn", "filed", "fye", "price"
+]
+COLUMN_TYPES = {
+    "ticker": str,
+    "form": str,
+    "cik": int,
+    "adsh": str,
+    "tag": str,
+    "ddate": int,
+    "qtrs": int,
+    "value": float,
+    "dimn": int,
+    "filed": int,
+    "fye": str,
+    "price": float
+}
+
+def simplify_ticker_files(input_dir, output_dir, tickers=None, checkpoint_dir=None, resume=False,
+                          compression=None, profile_dir=None):
     """
     Reads each ticker file in input_dir, keeps only the selected columns,
     and writes the simplified file to output_dir.
+    Only `tickers` are processed if given. Finished tickers are recorded in
+    checkpoint_dir, and with resume=True the ones already recorded are skipped.
+    Output files are written with the given `compression`. Each ticker's
+    cost is recorded, and profiled into `profile_dir` if given.
     """
-    selected_columns = [
-        "ticker", "form", "cik", "adsh", "tag",
-        "ddate", "qtrs", "value", "dimn", "filed", "price"
-    ]
-    column_types = {
-        "ticker": str,
-        "form": str,
-        "cik": int,
-        "adsh": str,
-        "tag": str,
-        "ddate": int,
-        "qtrs": int,
-        "value": float,
-        "dimn": int,
-        "filed": int,
-        "price": float
-    }
-
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    tsv_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.tsv')]
+    done = completed_tickers(checkpoint_dir, CHECKPOINT_STAGE) if resume else set()
+    tsv_files = {
+        ticker: filename for ticker, filename in list_ticker_files(input_dir, tickers).items()
+        if ticker not in done
+    }
 
-    for filename in tqdm(tsv_files, desc="Simplifying ticker files", unit='file'):
-        ticker = filename.replace('.tsv', '')
+    for ticker, filename in tqdm(tsv_files.items(), desc="Simplifying ticker files", unit='file'):
         file_path = os.path.join(input_dir, filename)
+        output_path = with_compression(os.path.join(output_dir, f"{ticker}.tsv"), compression)
+        with ticker_cost(CHECKPOINT_STAGE, ticker, profile_dir) as cost:
+            cost["rows"] = simplify_ticker_file(file_path, output_path)
+        mark_ticker_complete(checkpoint_dir, CHECKPOINT_STAGE, ticker)
+
+    print(f"Simplified ticker files saved to: {output_dir}")
+
+
+def simplify_ticker_file(input_path, output_path):
+    """
+    Keep only the selected columns of one ticker file, cast to their final
+    types, and write it to output_path. Returns the number of rows.
+    """
+    with open_tsv(input_path) as in_f:
         df = pd.read_csv(
-            file_path,
+            in_f,
             sep='\t',
-            usecols=selected_columns,
-            dtype=column_types,
+            usecols=lambda col: col in SELECTED_COLUMNS,  # files split before fye was added lack it
+            dtype=COLUMN_TYPES,
             na_values=["Unknown"]
         )
-        output_path = os.path.join(output_dir, f"{ticker}.tsv")
-        df.to_csv(output_path, sep="\t", index=False)
-
-    print(f"Simplified ticker files saved to: {output_dir}")
+    with atomic_write(output_path, newline='') as out_f:
+        df.to_csv(out_f, sep="\t", index=False)
+    return len(df)
@@ -2,26 +2,39 @@
 
 import os
 import csv
+import shutil
 from tqdm import tqdm
 from pathlib import Path
 from itertools import islice
 
-def split_updated_num(updated_num_file, output_dir, chunk_size=200_000):
+from compression import open_tsv, with_compression, remove_other_variants
+
+def split_updated_num(updated_num_file, output_dir, chunk_size=200_000, tickers=None, compression=None):
     """
     Splits a large 'updated_num_file' into per-ticker TSVs without
     keeping all file handles open at the same time.
     Reads 'chunk_size' lines at a time, groups them by ticker,
     and writes them out in batch.
+
+    Files are appended to in a staging directory that replaces output_dir only
+    once every row is written, so an interrupted split never leaves partial or
+    doubled-up ticker files behind. If `tickers` is given, only those
+    tickers' files are rebuilt (matched case-insensitively) and all other
+    files in output_dir are kept.
+    Ticker files are written with the given `compression` (None, "gzip", "zstd").
     """
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    staging_dir = output_dir.rstrip("/\\") + ".partial"
+    if os.path.isdir(staging_dir):
+        shutil.rmtree(staging_dir)  # left over from an interrupted run
+    Path(staging_dir).mkdir(parents=True, exist_ok=True)
 
     # First, read the header line
-    with open(updated_num_file, 'r', encoding='utf-8', newline='') as f_in:
+    with open_tsv(updated_num_file) as f_in:
         reader = csv.reader(f_in, delimiter='\t')
         header = next(reader)  # store the column names
 
     # Count total rows (minus header) for tqdm
-    with open(updated_num_file, 'r', encoding='utf-8') as f_in:
+    with open_tsv(updated_num_file) as f_in:
         total_lines = sum(1 for _ in f_in) - 1
 
     def write_chunk_rows(bucket, header):
@@ -32,14 +45,14 @@ def split_updated_num(updated_num_file, output_dir, chunk_size=200_000):
         for ticker, rows in bucket.items():
             if not ticker.strip():
                 continue
-            file_path = os.path.join(output_dir, f"{ticker}.tsv")
+            file_path = with_compression(os.path.join(staging_dir, f"{ticker}.tsv"), compression)
 
             # Determine if file already exists to know if we write header
             file_exists = os.path.exists(file_path)
 
             # Open in append mode if exists, otherwise write mode
             mode = 'a' if file_exists else 'w'
-            with open(file_path, mode, newline='', encoding='utf-8') as f_out:
+            with open_tsv(file_path, mode) as f_out:
                 writer = csv.DictWriter(f_out, fieldnames=header, delimiter='\t')
                 if not file_exists:
                     writer.writeheader()
@@ -48,10 +61,12 @@ def split_updated_num(updated_num_file, output_dir, chunk_size=200_000):
         bucket.clear()  # release memory
 
     # Now read in chunks of lines
-    with open(updated_num_file, 'r', encoding='utf-8', newline='') as f_in:
+    with open_tsv(updated_num_file) as f_in:
         reader = csv.DictReader(f_in, delimiter='\t', fieldnames=header)
         next(reader)  # skip the first line again (header) so we don't re-parse it
 
+        wanted = None if tickers is None else {t.lower() for t in tickers}
+        found = set()
         pbar = tqdm(total=total_lines, desc="Splitting by ticker", unit="row")
         bucket = {}  # ticker -> list of row-dicts
         lines_in_bucket = 0
@@ -59,8 +74,11 @@ def split_updated_num(updated_num_file, output_dir, chunk_size=200_000):
         for row in reader:
             pbar.update(1)
             ticker = (row.get('ticker') or '').strip()
+            if wanted is not None and ticker.lower() not in wanted:
+                continue
             if ticker not in bucket:
                 bucket[ticker] = []
+                found.add(ticker.lower())
             bucket[ticker].append(row)
             lines_in_bucket += 1
 
@@ -75,5 +93,20 @@ def split_updated_num(updated_num_file, output_dir, chunk_size=200_000):
 
         pbar.close()
 
+    if wanted is not None and wanted - found:
+        print(f"Warning: no rows in {updated_num_file} for tickers: {', '.join(sorted(wanted - found))}")
+
+    if tickers is None:
+        if os.path.isdir(output_dir):
+            shutil.rmtree(output_dir)
+        os.replace(staging_dir, output_dir)
+    else:
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        for filename in os.listdir(staging_dir):
+            out_path = os.path.join(output_dir, filename)
+            os.replace(os.path.join(staging_dir, filename), out_path)
+            remove_other_variants(out_path)
+        shutil.rmtree(staging_dir)
+
     print(f"Ticker files saved to: {output_dir}")
 
@@ -1,78 +1,367 @@
 # main.py
 
+import argparse
+import os
+
 from settings import (
     INPUT_DIR,
     OUTPUT_DIR,
     COMBINED_NUM_PATH,
     COMBINED_SUB_PATH,
     UPDATED_COMBINED_NUM_PATH,
+    POINT_IN_TIME_INDEX_PATH,
     TICKER_SPLIT_DIR,
     TICKER_PRICE_DIR,
     FINAL_TICKER_DIR,
     CONFIG_FILE,
-    BLOOMBERG_STYLE_DIR
+    BLOOMBERG_STYLE_DIR,
+    CHECKPOINT_DIR,
+    RESTATEMENT_POLICY,
+    SCHEDULER_WORKERS,
+    SCHEDULER_QUEUE_SIZE,
+    SHARDS_DIR,
+    PRICE_CALLS_PER_MINUTE,
+    ARTIFACT_COMPRESSION,
+    FISCAL_YEAR_START,
+    FISCAL_YEAR_END,
+    COST_REPORT_PATH,
+    COST_REPORT_TOP_N,
+    PROFILE_DIR
 )
 
-from data_combination import combine_num_files, combine_sub_files, merge_num_and_sub
-from data_split import split_updated_num
-from oauth import load_config, get_bearer_token
-from data_price import add_price_to_files
-from data_simplify import simplify_ticker_files
-from data_bloomberg import transform_all_tickers
+from checkpoint import clear_stage, is_stage_complete, mark_stage_complete
+
+# Pipeline stages in run order. The heavy modules (pandas, requests, OAuth)
+# are only imported once a stage that needs them is about to run.
+STAGES = [
+    "combine_num",
+    "combine_sub",
+    "merge",
+    "pit_index",
+    "split",
+    "price",
+    "simplify",
+    "pivot",
+]
+
+# Stages that work on one ticker file at a time and honour --tickers
+PER_TICKER_STAGES = {"split", "price", "simplify", "pivot"}
+
+# Stages whose per-ticker calls can be profiled with --profile
+PROFILED_STAGES = ["price", "simplify", "pivot"]
+
+
+def parse_stages(spec):
+    """
+    Turn a --stages value into an ordered list of stage names.
+    Accepts 'all', comma-separated names and first-last ranges, e.g.
+    'pivot', 'price,simplify' or 'split-pivot'.
+    """
+    if not spec or spec == "all":
+        return list(STAGES)
+
+    selected = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        last = last or first
+        for name in (first, last):
+            if name not in STAGES:
+                raise argparse.ArgumentTypeError(
+                    f"Unknown stage '{name}'. Choose from: {', '.join(STAGES)}"
+                )
+        start, end = STAGES.index(first), STAGES.index(last)
+        if start > end:
+            raise argparse.ArgumentTypeError(f"Stage range '{part}' runs backwards")
+        selected.update(STAGES[start:end + 1])
+    return [stage for stage in STAGES if stage in selected]
+
+
+def parse_tickers(spec):
+    """
+    Turn a --tickers value like 'AAPL,MSFT' into a set of ticker names,
+    lower-cased to match SEC's ticker list and so the file names.
+    """
+    tickers = {t.strip().lower() for t in spec.split(",") if t.strip()}
+    if not tickers:
+        raise argparse.ArgumentTypeError("No tickers given")
+    return tickers
+
+
+def parse_profile(spec):
+    """Turn a --profile value like 'pivot' or 'price,simplify' into a set of stage names."""
+    if spec == "all":
+        return set(PROFILED_STAGES)
+    stages = set(parse_stages(spec))
+    if not stages <= set(PROFILED_STAGES):
+        raise argparse.ArgumentTypeError(f"--profile works on the stages: {', '.join(PROFILED_STAGES)}")
+    return stages
+
+
+def parse_shard_arg(spec):
+    """argparse wrapper around sharding.parse_shard()."""
+    from sharding import parse_shard
+    try:
+        return parse_shard(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def main(stages=None, tickers=None, resume=False, workers=SCHEDULER_WORKERS,
+         shard=None, price_budget=None, profile=()):
+    all_tickers = tickers is None
+    checkpoint_dir = CHECKPOINT_DIR
+    price_dir, final_dir, bloomberg_dir = TICKER_PRICE_DIR, FINAL_TICKER_DIR, BLOOMBERG_STYLE_DIR
+    cost_report_path, profile_dir = COST_REPORT_PATH, PROFILE_DIR
+
+    # A shard runs the per-ticker stages for its own subset of Ticker_Split
+    # into its own directories; --merge-shards assembles the results
+    if shard is not None:
+        from sharding import SHARD_STAGES, shard_dirs, shard_root, tickers_for_shard
+        index, count = shard
+        stages = list(SHARD_STAGES) if stages is None else stages
+        if any(stage not in SHARD_STAGES for stage in stages):
+            raise SystemExit(f"--shard only runs the stages {', '.join(SHARD_STAGES)}; split the data first.")
+        dirs = shard_dirs(SHARDS_DIR, index, count)
+        checkpoint_dir = dirs["checkpoint"]
+        price_dir, final_dir, bloomberg_dir = dirs["price"], dirs["final"], dirs["bloomberg"]
+        cost_report_path = os.path.join(shard_root(SHARDS_DIR, index, count), "cost_report.tsv")
+        profile_dir = os.path.join(shard_root(SHARDS_DIR, index, count), "Profiles")
+        shard_tickers = tickers_for_shard(TICKER_SPLIT_DIR, index, count)
+        tickers = shard_tickers if tickers is None else shard_tickers & tickers
+        if price_budget is None:
+            price_budget = PRICE_CALLS_PER_MINUTE / count  # shards share one API key
+        print(f"Shard {index}/{count}: {len(tickers)} tickers")
+
+    stages = list(STAGES) if stages is None else stages
+
+    # Without --resume the selected stages run again from scratch. A --tickers
+    # run only touches some tickers, so it leaves recorded progress alone.
+    if not resume and all_tickers:
+        for stage in stages:
+            clear_stage(checkpoint_dir, stage)
+
+    def pending(stage):
+        if stage not in stages:
+            return False
+        if resume and is_stage_complete(checkpoint_dir, stage):
+            print(f"Skipping '{stage}': completed in a previous run")
+            return False
+        return True
+
+    def finished(stage):
+        # A stage is only complete once it has covered every ticker
+        if all_tickers or stage not in PER_TICKER_STAGES:
+            mark_stage_complete(checkpoint_dir, stage)
 
-def main():
     # Step 1: Combine num files
-    selected_num_columns = ["adsh", "tag", "ddate", "qtrs", "value", "dimn"]
-    combine_num_files(
-        input_dir=INPUT_DIR,
-        output_file=COMBINED_NUM_PATH,
-        selected_columns=selected_num_columns,
-        na_fill_value=None
-    )
+    if pending("combine_num"):
+        from data_combination import combine_num_files
+        from data_bloomberg import fiscal_window_ddates
+        selected_num_columns = ["adsh", "tag", "ddate", "qtrs", "value", "dimn", "dimh"]
+        min_ddate, max_ddate = fiscal_window_ddates(FISCAL_YEAR_START, FISCAL_YEAR_END)
+        combine_num_files(
+            input_dir=INPUT_DIR,
+            output_file=COMBINED_NUM_PATH,
+            selected_columns=selected_num_columns,
+            na_fill_value=None,
+            min_ddate=min_ddate,
+            max_ddate=max_ddate
+        )
+        finished("combine_num")
 
     # Step 2: Combine sub files + add ticker
-    combine_sub_files(
-        input_dir=INPUT_DIR,
-        output_file=COMBINED_SUB_PATH,
-        na_fill_value=None
-    )
+    if pending("combine_sub"):
+        from data_combination import combine_sub_files
+        combine_sub_files(
+            input_dir=INPUT_DIR,
+            output_file=COMBINED_SUB_PATH,
+            na_fill_value=None
+        )
+        finished("combine_sub")
 
-    # Step 3: Merge combined num & sub on 'adsh'
-    merge_num_and_sub(
-        num_file=COMBINED_NUM_PATH,
-        sub_file=COMBINED_SUB_PATH,
-        output_file=UPDATED_COMBINED_NUM_PATH
-    )
+    # Step 3: Merge combined num & sub on 'adsh', dropping duplicate facts
+    if pending("merge"):
+        from data_combination import merge_num_and_sub
+        merge_num_and_sub(
+            num_file=COMBINED_NUM_PATH,
+            sub_file=COMBINED_SUB_PATH,
+            output_file=UPDATED_COMBINED_NUM_PATH,
+            restatement_policy=RESTATEMENT_POLICY
+        )
+        finished("merge")
+
+    # Step 3b: Index every reported value by filed date for as-of queries
+    if pending("pit_index"):
+        from data_point_in_time import build_point_in_time_index
+        build_point_in_time_index(
+            updated_num_file=UPDATED_COMBINED_NUM_PATH,
+            output_file=POINT_IN_TIME_INDEX_PATH
+        )
+        finished("pit_index")
 
     # Step 4: Split the updated file into per-ticker
-    split_updated_num(
-        updated_num_file=UPDATED_COMBINED_NUM_PATH,
-        output_dir=TICKER_SPLIT_DIR
-    )
+    if pending("split"):
+        from data_split import split_updated_num
+        split_updated_num(
+            updated_num_file=UPDATED_COMBINED_NUM_PATH,
+            output_dir=TICKER_SPLIT_DIR,
+            tickers=tickers,
+            compression=ARTIFACT_COMPRESSION["ticker_split"]
+        )
+        finished("split")
 
-    # Step 5: OAuth and add price data
-    load_config(CONFIG_FILE)    # loads APP_KEY, ACCESS_TOKEN, etc.
-    get_bearer_token()         # triggers OAuth flow if tokens missing/expired
-    add_price_to_files(
-        input_dir=TICKER_SPLIT_DIR,
-        output_dir=TICKER_PRICE_DIR
-    )
+    ticker_stages = [stage for stage in ("price", "simplify", "pivot") if pending(stage)]
+    profile_dirs = {stage: profile_dir for stage in ticker_stages if stage in profile}
 
-    # Step 6: Simplify columns
-    simplify_ticker_files(
-        input_dir=TICKER_PRICE_DIR,
-        output_dir=FINAL_TICKER_DIR
-    )
+    # Step 5 needs Schwab credentials; never prompt for them otherwise
+    if "price" in ticker_stages:
+        from oauth import load_config, get_bearer_token, set_price_rate_limit
+        load_config(CONFIG_FILE)    # loads APP_KEY, ACCESS_TOKEN, etc.
+        get_bearer_token()         # triggers OAuth flow if tokens missing/expired
+        if price_budget is not None:
+            set_price_rate_limit(price_budget)
 
-    # Step 7: Transform data into Bloomberg_Style tsv tables
-    transform_all_tickers(
-        input_dir=FINAL_TICKER_DIR,
-        output_dir=BLOOMBERG_STYLE_DIR
-    )
+    # Steps 5-7 per ticker: price on a background thread while a process pool
+    # simplifies and pivots the tickers that are already priced
+    if ticker_stages and workers != 0:
+        from scheduler import run_ticker_pipeline
+        run_ticker_pipeline(
+            split_dir=TICKER_SPLIT_DIR,
+            price_dir=price_dir,
+            final_dir=final_dir,
+            bloomberg_dir=bloomberg_dir,
+            stages=ticker_stages,
+            tickers=tickers,
+            checkpoint_dir=checkpoint_dir,
+            resume=resume,
+            workers=workers,
+            queue_size=SCHEDULER_QUEUE_SIZE,
+            price_compression=ARTIFACT_COMPRESSION["ticker_with_price"],
+            final_compression=ARTIFACT_COMPRESSION["final_ticker"],
+            bloomberg_compression=ARTIFACT_COMPRESSION["bloomberg"],
+            start_year=FISCAL_YEAR_START,
+            end_year=FISCAL_YEAR_END,
+            profile_dirs=profile_dirs
+        )
+        for stage in ticker_stages:
+            finished(stage)
+
+    # With --workers 0 the stages run one after another in this process
+    else:
+        # Step 5: Add price data (resumable per ticker)
+        if "price" in ticker_stages:
+            from data_price import add_price_to_files
+            add_price_to_files(
+                input_dir=TICKER_SPLIT_DIR,
+                output_dir=price_dir,
+                tickers=tickers,
+                checkpoint_dir=checkpoint_dir,
+                resume=resume,
+                compression=ARTIFACT_COMPRESSION["ticker_with_price"],
+                profile_dir=profile_dirs.get("price")
+            )
+            finished("price")
+
+        # Step 6: Simplify columns (resumable per ticker)
+        if "simplify" in ticker_stages:
+            from data_simplify import simplify_ticker_files
+            simplify_ticker_files(
+                input_dir=price_dir,
+                output_dir=final_dir,
+                tickers=tickers,
+                checkpoint_dir=checkpoint_dir,
+                resume=resume,
+                compression=ARTIFACT_COMPRESSION["final_ticker"],
+                profile_dir=profile_dirs.get("simplify")
+            )
+            finished("simplify")
 
-    print(f"Bloomberg-style tables are in: {BLOOMBERG_STYLE_DIR}")
+        # Step 7: Transform data into Bloomberg_Style tsv tables (resumable per ticker)
+        if "pivot" in ticker_stages:
+            from data_bloomberg import transform_all_tickers
+            transform_all_tickers(
+                input_dir=final_dir,
+                output_dir=bloomberg_dir,
+                tickers=tickers,
+                checkpoint_dir=checkpoint_dir,
+                resume=resume,
+                compression=ARTIFACT_COMPRESSION["bloomberg"],
+                start_year=FISCAL_YEAR_START,
+                end_year=FISCAL_YEAR_END,
+                profile_dir=profile_dirs.get("pivot")
+            )
+            finished("pivot")
 
+    # Which tickers were expensive, and where the time went
+    if ticker_stages:
+        from profiling import write_cost_report
+        write_cost_report(cost_report_path, top_n=COST_REPORT_TOP_N, merge=resume or not all_tickers)
+        if profile_dirs:
+            print(f"Per-ticker profiles ({', '.join(profile_dirs)}) are in: {profile_dir}")
+
+    if shard is not None:
+        from sharding import write_shard_manifest
+        write_shard_manifest(SHARDS_DIR, index, count, shard_tickers)
+
+    if "pivot" in ticker_stages:
+        print(f"Bloomberg-style tables are in: {bloomberg_dir}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Build Bloomberg-style tables from SEC financial data sets.")
+    parser.add_argument(
+        "--stages", type=parse_stages, default=None,
+        help=f"stages to run: 'all' (default), names or first-last ranges from: {', '.join(STAGES)}"
+    )
+    parser.add_argument(
+        "--tickers", type=parse_tickers, default=None,
+        help="comma-separated tickers for the per-ticker stages (split onward), e.g. AAPL,MSFT"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="skip stages and tickers completed by a previous, interrupted run"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=SCHEDULER_WORKERS,
+        help="worker processes for simplify/pivot while pricing runs (default: one per CPU; 0 runs stages one after another)"
+    )
+    parser.add_argument(
+        "--profile", type=parse_profile, default=set(), metavar="STAGES",
+        help=f"profile each ticker of these stages ({', '.join(PROFILED_STAGES)}) with cProfile and tracemalloc"
+    )
+    parser.add_argument(
+        "--shard", type=parse_shard_arg, default=None, metavar="i/N",
+        help="run the price, simplify and pivot stages for shard i of N (tickers split by hash)"
+    )
+    parser.add_argument(
+        "--merge-shards", type=int, default=None, metavar="N",
+        help="check that all N shards finished and copy their outputs into the regular output folders"
+    )
+    parser.add_argument(
+        "--price-budget", type=float, default=None, metavar="CALLS_PER_MINUTE",
+        help=f"price API calls per minute for this process (default: {PRICE_CALLS_PER_MINUTE}, divided by N when sharded)"
+    )
+    args = parser.parse_args()
 
+    if args.merge_shards is not None:
+        from sharding import merge_shards
+        merge_shards(
+            count=args.merge_shards,
+            shards_dir=SHARDS_DIR,
+            split_dir=TICKER_SPLIT_DIR,
+            price_dir=TICKER_PRICE_DIR,
+            final_dir=FINAL_TICKER_DIR,
+            bloomberg_dir=BLOOMBERG_STYLE_DIR
+        )
+    else:
+        main(
+            stages=args.stages,
+            tickers=args.tickers,
+            resume=args.resume,
+            workers=args.workers,
+            shard=args.shard,
+            price_budget=args.price_budget,
+            profile=args.profile
+        )
@@ -23,6 +23,7 @@ LAST_TOKEN_TIME = None
 
 # We also store this in memory
 LAST_CALL_TIME = 0.0
+API_CALL_COUNT = 0  # price API calls made by this process, for cost reports
 
 
 def load_config(file_path: str) -> None:
@@ -210,9 +211,18 @@ def get_bearer_token() -> str:
     return ACCESS_TOKEN
 
 
+def set_price_rate_limit(calls_per_minute: float) -> None:
+    """Throttle price calls to `calls_per_minute`, e.g. one shard's share of the budget."""
+    global MIN_TIME_BETWEEN_CALLS
+    if calls_per_minute <= 0:
+        raise ValueError("calls_per_minute must be positive")
+    MIN_TIME_BETWEEN_CALLS = 60.0 / calls_per_minute
+    logger.info(f"Price API limited to {calls_per_minute:.1f} calls per minute.")
+
+
 def _make_schwab_api_call(params):
     """Internal helper to rate-limit and call the Schwab API."""
-    global LAST_CALL_TIME
+    global LAST_CALL_TIME, API_CALL_COUNT
     elapsed = time.time() - LAST_CALL_TIME
     if elapsed < MIN_TIME_BETWEEN_CALLS:
         time.sleep(MIN_TIME_BETWEEN_CALLS - elapsed)
@@ -231,13 +241,17 @@ def _make_schwab_api_call(params):
         f"&startDate={date_unix_ms}&endDate={date_unix_ms}"
     )
     LAST_CALL_TIME = time.time()
+    API_CALL_COUNT += 1
     resp = requests.get(PRICE_ENDPOINT, headers=headers)
     resp.raise_for_status()
     return resp.json()
 
 
 def get_price_for_date(ticker, date_after_filed_datetime):
-    """Fetch historical price for `ticker` on `date_after_filed_datetime` (or next available day)."""
+    """
+    Fetch historical price for `ticker` on `date_after_filed_datetime` (or next available day).
+    Returns None when no price exists; connection and non-400 HTTP errors are raised.
+    """
     for attempt in range(6):
         date_unix_ms = int(date_after_filed_datetime.timestamp() * 1000)
         params = {"symbol": ticker.upper(), "date": date_unix_ms}
@@ -260,6 +274,9 @@ def get_price_for_date(ticker, date_after_filed_datetime):
                 f"Response JSON missing fields for {ticker} on {date_after_filed_datetime.strftime('%Y-%m-%d')}."
             )
             return None
+        except requests.exceptions.RequestException:
+            # Connection, timeout and token failures: let the caller stop and resume later
+            raise
         except Exception as e:
             logger.error(f"Error fetching price for {ticker}: {e}")
             return None
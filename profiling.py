@@ -0,0 +1,222 @@
+# profiling.py
+
+import cProfile
+import csv
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from checkpoint import atomic_write
+
+try:
+    import psutil
+except ImportError:  # peak memory is then only known for calls that raise the process high-water mark
+    psutil = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+COST_FIELDS = ["stage", "ticker", "rows", "wall_s", "cpu_s", "api_calls", "peak_mem_mb", "traced_peak_mb"]
+
+# Cost of every per-ticker call made by this process, in call order
+COST_RECORDS = []
+
+RSS_SAMPLE_INTERVAL = 0.01  # seconds between RSS samples while a call runs
+
+
+def _api_calls():
+    # Read the counter without importing oauth into processes that never call the API
+    oauth = sys.modules.get("oauth")
+    return getattr(oauth, "API_CALL_COUNT", 0)
+
+
+def _rss_mb():
+    if psutil is None:
+        return None
+    return psutil.Process(os.getpid()).memory_info().rss / 2**20
+
+
+def _max_rss_mb():
+    """The process's peak RSS so far (ru_maxrss is KB on Linux, bytes on macOS)."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+class _PeakRssSampler:
+    """
+    One background thread per process that samples RSS while any call is
+    being measured and keeps the highest value seen by each call.
+    """
+
+    def __init__(self):
+        self._peaks = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, token):
+        rss = _rss_mb()
+        if rss is None:
+            return
+        with self._lock:
+            self._peaks[token] = rss
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def stop(self, token):
+        rss = _rss_mb()
+        with self._lock:
+            peak = self._peaks.pop(token, None)
+        if peak is None:
+            return None
+        return max(peak, rss)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._peaks:
+                    self._wake.clear()
+                    continue
+            rss = _rss_mb()
+            with self._lock:
+                for token, peak in self._peaks.items():
+                    if rss > peak:
+                        self._peaks[token] = rss
+            time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+_SAMPLER = _PeakRssSampler()
+
+
+@contextmanager
+def ticker_cost(stage, ticker, profile_dir=None, records=None):
+    """
+    Record the cost of one stage's work on one ticker: wall time, CPU time,
+    Schwab API calls and peak RSS. Set record["rows"] inside the block. The
+    record goes to `records` (default: COST_RECORDS).
+
+    CPU time is the process's, or only the calling thread's when called off
+    the main thread (the scheduler's price thread shares its process with the
+    main loop). Peak RSS is sampled every RSS_SAMPLE_INTERVAL, and is exact
+    whenever the call raises the process's high-water mark.
+
+    With `profile_dir`, the block also runs under cProfile and tracemalloc;
+    the results go to profile_dir/<stage>/<ticker>.prof (open with pstats or
+    snakeviz) and <ticker>.mem.txt, and the tracemalloc peak is recorded.
+    """
+    record = dict.fromkeys(COST_FIELDS)
+    record.update(stage=stage, ticker=ticker)
+    cpu_clock = time.process_time if threading.current_thread() is threading.main_thread() else time.thread_time
+
+    profiler = None
+    started_tracing = False
+    if profile_dir is not None:
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    token = object()
+    max_rss_before = _max_rss_mb()
+    _SAMPLER.start(token)
+    api_before = _api_calls()
+    wall_start = time.perf_counter()
+    cpu_start = cpu_clock()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = time.perf_counter() - wall_start
+        record["cpu_s"] = cpu_clock() - cpu_start
+        record["api_calls"] = _api_calls() - api_before
+        peak = _SAMPLER.stop(token)
+        max_rss_after = _max_rss_mb()
+        if max_rss_after is not None and max_rss_after > max_rss_before:
+            # The process reached a new high during this call, so that is its peak
+            peak = max_rss_after if peak is None else max(peak, max_rss_after)
+        record["peak_mem_mb"] = peak
+        if profiler is not None:
+            profiler.disable()
+            _, traced_peak = tracemalloc.get_traced_memory()
+            record["traced_peak_mb"] = traced_peak / 2**20
+            _dump_profile(profile_dir, stage, ticker, profiler, tracemalloc.take_snapshot(), traced_peak)
+            if started_tracing:
+                tracemalloc.stop()
+        (COST_RECORDS if records is None else records).append(record)
+
+
+def _dump_profile(profile_dir, stage, ticker, profiler, snapshot, peak, top=25):
+    stage_dir = os.path.join(profile_dir, stage)
+    os.makedirs(stage_dir, exist_ok=True)
+    profiler.dump_stats(os.path.join(stage_dir, f"{ticker}.prof"))
+    with open(os.path.join(stage_dir, f"{ticker}.mem.txt"), "w", encoding="utf-8") as f:
+        f.write(f"{stage} {ticker}: peak traced memory {peak / 2**20:.1f} MB\n")
+        f.write(f"Top {top} allocation sites still held at the end:\n")
+        for stat in snapshot.statistics("lineno")[:top]:
+            f.write(f"{stat}\n")
+
+
+def _read_cost_report(path):
+    """Records of an earlier cost report, with numbers parsed back."""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for record in csv.DictReader(f, delimiter="\t"):
+            for field in COST_FIELDS[2:]:
+                value = record.get(field) or None
+                if value is not None:
+                    value = int(value) if field in ("rows", "api_calls") else float(value)
+                record[field] = value
+            records.append({field: record.get(field) for field in COST_FIELDS})
+    return records
+
+
+def write_cost_report(output_file, top_n=20, records=None, merge=False):
+    """
+    Write one row per (stage, ticker) call, slowest first, to `output_file`
+    and print the `top_n` slowest. With merge=True (a resumed run) the rows
+    of the existing report are kept for every (stage, ticker) not measured
+    again, so the report still covers the whole run.
+    """
+    records = list(COST_RECORDS if records is None else records)
+    if not records:
+        return
+    if merge:
+        measured = {(r["stage"], r["ticker"]) for r in records}
+        records += [
+            r for r in _read_cost_report(output_file) if (r["stage"], r["ticker"]) not in measured
+        ]
+    ranked = sorted(records, key=lambda r: r["wall_s"], reverse=True)
+
+    def fmt(value):
+        if value is None:
+            return ""
+        return f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    with atomic_write(output_file, newline="") as f:
+        f.write("\t".join(COST_FIELDS) + "\n")
+        for record in ranked:
+            f.write("\t".join(fmt(record[field]) for field in COST_FIELDS) + "\n")
+
+    print(f"Slowest {min(top_n, len(ranked))} of {len(ranked)} per-ticker calls:")
+    print(f"  {'stage':<9} {'ticker':<10} {'rows':>9} {'wall s':>8} {'cpu s':>8} {'api':>5} {'peak MB':>8}")
+    for r in ranked[:top_n]:
+        peak = f"{r['peak_mem_mb']:.1f}" if r["peak_mem_mb"] is not None else "-"
+        print(
+            f"  {r['stage']:<9} {r['ticker']:<10} {fmt(r['rows']):>9} {r['wall_s']:>8.2f} "
+            f"{r['cpu_s']:>8.2f} {r['api_calls']:>5} {peak:>8}"
+        )
+    print(f"Per-ticker cost report saved to: {output_file}")
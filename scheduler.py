@@ -0,0 +1,208 @@
+# scheduler.py
+
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from tqdm import tqdm
+
+from checkpoint import completed_tickers, mark_ticker_complete
+from compression import find_tsv, list_ticker_files, with_compression
+from profiling import COST_RECORDS, ticker_cost
+from data_simplify import simplify_ticker_file, CHECKPOINT_STAGE as SIMPLIFY_STAGE
+from data_bloomberg import process_single_ticker_tsv, CHECKPOINT_STAGE as PIVOT_STAGE
+
+# data_price.CHECKPOINT_STAGE; data_price itself (and with it oauth and
+# requests) is only imported once a ticker is actually priced
+PRICE_STAGE = "price"
+
+TICKER_STAGES = (PRICE_STAGE, SIMPLIFY_STAGE, PIVOT_STAGE)
+
+_END_OF_TICKERS = None  # queue sentinel: the price thread has finished
+
+
+def _cpu_stages(ticker, price_dir, final_dir, bloomberg_dir, run_simplify, run_pivot,
+                final_compression, bloomberg_compression, start_year, end_year,
+                profile_dirs):
+    """
+    Simplify and pivot one ticker. Runs in a worker process, so the cost
+    records are returned for the parent to collect.
+    """
+    records = []
+    if run_simplify:
+        final_path = with_compression(os.path.join(final_dir, f"{ticker}.tsv"), final_compression)
+        with ticker_cost(SIMPLIFY_STAGE, ticker, profile_dirs.get(SIMPLIFY_STAGE), records) as cost:
+            cost["rows"] = simplify_ticker_file(find_tsv(price_dir, ticker), final_path)
+    if run_pivot:
+        with ticker_cost(PIVOT_STAGE, ticker, profile_dirs.get(PIVOT_STAGE), records) as cost:
+            cost["rows"] = process_single_ticker_tsv(find_tsv(final_dir, ticker), bloomberg_dir, ticker,
+                                                     compression=bloomberg_compression,
+                                                     start_year=start_year, end_year=end_year)
+    return records
+
+
+def _pool_context():
+    """
+    Start workers with forkserver (spawn where unavailable), never fork():
+    the price thread is running while the pool grows, and a forked child
+    could inherit a lock it holds (loguru, tqdm, requests) and deadlock.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _put(ready, item, stop):
+    """Block while the CPU side is behind, but give up once it has stopped."""
+    while not stop.is_set():
+        try:
+            ready.put(item, timeout=0.5)
+            return
+        except queue.Full:
+            continue
+
+
+def _price_tickers(tickers, split_dir, price_dir, final_dir, todo, price_compression,
+                   checkpoint_dir, price_profile_dir, ready, stop, errors, pbar):
+    """
+    Price tickers one at a time (the API is rate limited anyway) and hand each
+    one to the CPU side through the bounded `ready` queue.
+    """
+    try:
+        for ticker in tickers:
+            if stop.is_set():
+                break
+            if todo(PRICE_STAGE, ticker):
+                from data_price import add_price_to_file
+                price_path = with_compression(os.path.join(price_dir, f"{ticker}.tsv"), price_compression)
+                with ticker_cost(PRICE_STAGE, ticker, price_profile_dir) as cost:
+                    cost["rows"] = add_price_to_file(find_tsv(split_dir, ticker), price_path, ticker)
+                mark_ticker_complete(checkpoint_dir, PRICE_STAGE, ticker)
+
+            # Files without a 'filed' column are never priced, so check the
+            # CPU side's input exists before queueing the ticker
+            if todo(SIMPLIFY_STAGE, ticker):
+                cpu_input = find_tsv(price_dir, ticker)
+            elif todo(PIVOT_STAGE, ticker):
+                cpu_input = find_tsv(final_dir, ticker)
+            else:
+                cpu_input = None
+            if cpu_input and os.path.exists(cpu_input):
+                _put(ready, ticker, stop)
+            else:
+                pbar.update(1)
+    except BaseException as e:
+        errors.append(e)
+    finally:
+        _put(ready, _END_OF_TICKERS, stop)
+
+
+def run_ticker_pipeline(split_dir, price_dir, final_dir, bloomberg_dir, stages=TICKER_STAGES,
+                        tickers=None, checkpoint_dir=None, resume=False, workers=None, queue_size=64,
+                        price_compression=None, final_compression=None, bloomberg_compression=None,
+                        start_year=None, end_year=None, profile_dirs=None):
+    """
+    Run the per-ticker stages (price -> simplify -> pivot) so each ticker moves
+    on as soon as its own previous stage is done, instead of waiting for every
+    ticker at each stage.
+
+    A background thread prices tickers through the rate-limited Schwab API
+    while a pool of `workers` processes (default: one per CPU) simplifies and
+    pivots the tickers that are already priced. At most `queue_size` priced
+    tickers wait for a worker, and at most two tasks per worker are in flight.
+    Each stage writes its files with the matching *_compression, and the
+    tables hold fiscal years start_year..end_year.
+
+    Every ticker's cost per stage ends up in profiling.COST_RECORDS; stages
+    in `profile_dirs` ({stage: directory}) are also profiled per ticker.
+    """
+    stages = [stage for stage in TICKER_STAGES if stage in stages]
+    profile_dirs = profile_dirs or {}
+    workers = workers or min(os.cpu_count() or 1, 61)  # Windows caps process pools at 61
+    for directory in (price_dir, final_dir, bloomberg_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    # The first selected stage decides where the ticker list comes from
+    source_dir = {PRICE_STAGE: split_dir, SIMPLIFY_STAGE: price_dir, PIVOT_STAGE: final_dir}[stages[0]]
+    all_tickers = list(list_ticker_files(source_dir, tickers))
+
+    done = {
+        stage: completed_tickers(checkpoint_dir, stage) if resume else set()
+        for stage in stages
+    }
+
+    def todo(stage, ticker):
+        return stage in stages and ticker not in done[stage]
+
+    def needs_cpu(ticker):
+        return todo(SIMPLIFY_STAGE, ticker) or todo(PIVOT_STAGE, ticker)
+
+    work = [t for t in all_tickers if todo(PRICE_STAGE, t) or needs_cpu(t)]
+    if resume and len(work) < len(all_tickers):
+        print(f"Resuming: {len(all_tickers) - len(work)} tickers already done")
+
+    ready = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    pbar = tqdm(total=len(work), desc=f"Running {' -> '.join(stages)} per ticker", unit="ticker")
+    pricer = threading.Thread(
+        target=_price_tickers,
+        args=(work, split_dir, price_dir, final_dir, todo, price_compression,
+              checkpoint_dir, profile_dirs.get(PRICE_STAGE), ready, stop, errors, pbar),
+        name="ticker-pricer",
+        daemon=True
+    )
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context()) as pool:
+            pricer.start()
+            max_in_flight = 2 * workers
+            in_flight = {}
+            feeding = True
+            while feeding or in_flight:
+                # Top up the pool with priced tickers; only block on the queue
+                # when there is nothing else to wait for
+                while feeding and len(in_flight) < max_in_flight:
+                    try:
+                        ticker = ready.get(block=not in_flight)
+                    except queue.Empty:
+                        break
+                    if ticker is _END_OF_TICKERS:
+                        feeding = False
+                        break
+                    future = pool.submit(
+                        _cpu_stages,
+                        ticker,
+                        price_dir,
+                        final_dir,
+                        bloomberg_dir,
+                        todo(SIMPLIFY_STAGE, ticker),
+                        todo(PIVOT_STAGE, ticker),
+                        final_compression,
+                        bloomberg_compression,
+                        start_year,
+                        end_year,
+                        profile_dirs
+                    )
+                    in_flight[future] = ticker
+
+                if not in_flight:
+                    continue
+                finished, _ = wait(in_flight, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    ticker = in_flight.pop(future)
+                    COST_RECORDS.extend(future.result())  # re-raises worker errors
+                    for stage in (SIMPLIFY_STAGE, PIVOT_STAGE):
+                        if todo(stage, ticker):
+                            mark_ticker_complete(checkpoint_dir, stage, ticker)
+                    pbar.update(1)
+    finally:
+        stop.set()
+        if pricer.is_alive():
+            pricer.join()
+        pbar.close()
+
+    if errors:
+        raise errors[0]
+
+    print(f"Per-ticker stages ({', '.join(stages)}) finished for {len(work)} tickers")
@@ -12,10 +12,52 @@ PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 INPUT_DIR = os.path.join(PROJECT_ROOT, "data", "input_data")
 OUTPUT_DIR = os.path.join(PROJECT_ROOT, "data", "output_data")
 
+# Compression of each output artifact: None (plain .tsv), "gzip" (.tsv.gz) or
+# "zstd" (.tsv.zst, needs `pip install zstandard`). zstd compresses on
+# ZSTD_THREADS threads while the file streams out (-1 = one per CPU).
+# Readers detect the format from the file name.
+COMPRESSION_SUFFIXES = {None: "", "gzip": ".gz", "zstd": ".zst"}
+ARTIFACT_COMPRESSION = {
+    "combined_num": None,
+    "combined_sub": None,
+    "updated_combined_num": None,
+    "point_in_time_index": None,
+    "ticker_split": None,
+    "ticker_with_price": None,
+    "final_ticker": None,
+    "bloomberg": None,
+}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+ZSTD_THREADS = -1
+
 # Intermediate combined file paths
-COMBINED_NUM_PATH = os.path.join(OUTPUT_DIR, "combined_num.tsv")
-COMBINED_SUB_PATH = os.path.join(OUTPUT_DIR, "combined_sub.tsv")
-UPDATED_COMBINED_NUM_PATH = os.path.join(OUTPUT_DIR, "updated_combined_num.tsv")
+COMBINED_NUM_PATH = os.path.join(
+    OUTPUT_DIR, "combined_num.tsv" + COMPRESSION_SUFFIXES[ARTIFACT_COMPRESSION["combined_num"]]
+)
+COMBINED_SUB_PATH = os.path.join(
+    OUTPUT_DIR, "combined_sub.tsv" + COMPRESSION_SUFFIXES[ARTIFACT_COMPRESSION["combined_sub"]]
+)
+UPDATED_COMBINED_NUM_PATH = os.path.join(
+    OUTPUT_DIR, "updated_combined_num.tsv" + COMPRESSION_SUFFIXES[ARTIFACT_COMPRESSION["updated_combined_num"]]
+)
+
+# Duplicate facts are dropped when num and sub are merged. Restatements of a
+# fact are all kept ("all"), or collapsed to the "first" or "latest" filed value
+RESTATEMENT_POLICY = "all"
+
+# As-first-reported fact index for point-in-time (no lookahead) queries
+POINT_IN_TIME_INDEX_PATH = os.path.join(
+    OUTPUT_DIR, "point_in_time_index.tsv" + COMPRESSION_SUFFIXES[ARTIFACT_COMPRESSION["point_in_time_index"]]
+)
+
+# Fiscal years shown in the Bloomberg-style tables (None = no limit). Facts
+# dated well before FISCAL_YEAR_START (or after FISCAL_YEAR_END) are dropped
+# when num.tsv is first combined, so they are never merged, split or priced.
+# Moving the window later only needs the pivot stage re-run; moving it
+# earlier needs the pipeline re-run from combine_num.
+FISCAL_YEAR_START = 2020
+FISCAL_YEAR_END = None
 
 # Directories for per-ticker files
 TICKER_SPLIT_DIR = os.path.join(OUTPUT_DIR, "Ticker_Split")
@@ -23,12 +65,39 @@ TICKER_PRICE_DIR = os.path.join(OUTPUT_DIR, "Ticker_With_Price")
 FINAL_TICKER_DIR = os.path.join(OUTPUT_DIR, "Final_Ticker_Files")
 BLOOMBERG_STYLE_DIR = os.path.join(OUTPUT_DIR, "Bloomberg_Style_Tables")
 
+# Per-ticker scheduler: worker processes for simplify/pivot (None = one per
+# CPU, 0 = run the stages one after another) and how many priced tickers
+# may wait for a free worker
+SCHEDULER_WORKERS = None
+SCHEDULER_QUEUE_SIZE = 64
+
+# Progress records for `python main.py --resume`
+CHECKPOINT_DIR = os.path.join(OUTPUT_DIR, ".checkpoints")
+
+# Per-shard outputs of `python main.py --shard i/N`, merged by --merge-shards N
+SHARDS_DIR = os.path.join(OUTPUT_DIR, "Shards")
+
+# Per-ticker cost (rows, wall/CPU time, API calls, memory) of the price,
+# simplify and pivot stages; the slowest COST_REPORT_TOP_N are printed.
+# `python main.py --profile pivot` also dumps cProfile/tracemalloc results
+# per ticker into PROFILE_DIR/<stage>/.
+COST_REPORT_PATH = os.path.join(OUTPUT_DIR, "cost_report.tsv")
+COST_REPORT_TOP_N = 20
+PROFILE_DIR = os.path.join(OUTPUT_DIR, "Profiles")
+
+# Local read API over the Bloomberg-style tables (`python api_server.py`).
+# Parsed tables are kept in memory up to about API_CACHE_MAX_BYTES.
+API_HOST = "127.0.0.1"
+API_PORT = 8000
+API_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 # Schwab API OAuth config
 CONFIG_FILE = os.path.join(PROJECT_ROOT, "config.env")
 
 # OAuth-related timing
 LAST_CALL_TIME = 0.0
-MIN_TIME_BETWEEN_CALLS = 60.0 / 115  # to avoid exceeding API rate limit of 120 calls per minute
+PRICE_CALLS_PER_MINUTE = 115  # to avoid exceeding API rate limit of 120 calls per minute
+MIN_TIME_BETWEEN_CALLS = 60.0 / PRICE_CALLS_PER_MINUTE
 TOKEN_REFRESH_INTERVAL = 1740  # 29 minutes to refresh access token just before it becomes deactivated
 
 # OAuth endpoints
@@ -0,0 +1,130 @@
+# sharding.py
+
+import os
+import json
+import shutil
+import zlib
+
+from checkpoint import atomic_write, is_stage_complete
+from compression import is_tsv, list_tsv_files
+
+SHARD_STAGES = ("price", "simplify", "pivot")
+MANIFEST_FILE = "manifest.json"
+
+
+def parse_shard(spec):
+    """Turn a --shard value like '2/8' into (index, count), with 0 <= index < count."""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, got '{spec}'")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in 0..{count - 1}, got '{spec}'")
+    return index, count
+
+
+def shard_of(ticker, count):
+    """
+    Shard number of `ticker`. Uses CRC32 rather than hash(), which is salted
+    per process, so every machine agrees on the assignment.
+    """
+    return zlib.crc32(ticker.encode("utf-8")) % count
+
+
+def shard_root(shards_dir, index, count):
+    """Directory holding everything one shard writes."""
+    return os.path.join(shards_dir, f"shard_{index}_of_{count}")
+
+
+def shard_dirs(shards_dir, index, count):
+    """Output and checkpoint directories used by one shard."""
+    root = shard_root(shards_dir, index, count)
+    return {
+        "price": os.path.join(root, "Ticker_With_Price"),
+        "final": os.path.join(root, "Final_Ticker_Files"),
+        "bloomberg": os.path.join(root, "Bloomberg_Style_Tables"),
+        "checkpoint": os.path.join(root, ".checkpoints"),
+    }
+
+
+def list_tickers(split_dir):
+    """All tickers with a file in the split directory."""
+    return list(list_tsv_files(split_dir))
+
+
+def tickers_for_shard(split_dir, index, count):
+    """The deterministic subset of tickers handled by shard `index` of `count`."""
+    return {t for t in list_tickers(split_dir) if shard_of(t, count) == index}
+
+
+def write_shard_manifest(shards_dir, index, count, tickers):
+    """Record which tickers this shard owns and which stages it has completed."""
+    dirs = shard_dirs(shards_dir, index, count)
+    manifest = {
+        "shard": index,
+        "count": count,
+        "tickers": sorted(tickers),
+        "completed_stages": [
+            stage for stage in SHARD_STAGES if is_stage_complete(dirs["checkpoint"], stage)
+        ],
+    }
+    path = os.path.join(shard_root(shards_dir, index, count), MANIFEST_FILE)
+    with atomic_write(path) as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _copy_into(src_path, dst_dir):
+    # Shard files are already compressed as their suffix says; copy the bytes as they are
+    dst_path = os.path.join(dst_dir, os.path.basename(src_path))
+    with open(src_path, "rb") as src, atomic_write(dst_path, "wb", compress=False) as dst:
+        shutil.copyfileobj(src, dst)
+
+
+def merge_shards(count, shards_dir, split_dir, price_dir, final_dir, bloomberg_dir):
+    """
+    Check that all `count` shards finished and together cover every ticker in
+    split_dir exactly once, then copy their per-ticker outputs into the regular
+    output directories. Shards are merged in order and files in sorted order,
+    so the result does not depend on which machine finished first.
+    """
+    expected = {}
+    for ticker in list_tickers(split_dir):
+        expected.setdefault(shard_of(ticker, count), set()).add(ticker)
+
+    problems = []
+    for index in range(count):
+        path = os.path.join(shard_root(shards_dir, index, count), MANIFEST_FILE)
+        if not os.path.exists(path):
+            problems.append(f"shard {index}/{count}: no manifest, has it run?")
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        missing_stages = [s for s in SHARD_STAGES if s not in manifest["completed_stages"]]
+        if missing_stages:
+            problems.append(f"shard {index}/{count}: stages not complete: {', '.join(missing_stages)}")
+        assigned = set(manifest["tickers"])
+        owed = expected.get(index, set())
+        if assigned != owed:
+            problems.append(
+                f"shard {index}/{count}: {len(owed - assigned)} tickers missing, "
+                f"{len(assigned - owed)} unexpected (was Ticker_Split rebuilt after sharding?)"
+            )
+    if problems:
+        raise RuntimeError("Cannot merge shards:\n  " + "\n  ".join(problems))
+
+    for directory in (price_dir, final_dir, bloomberg_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    copied = 0
+    for index in range(count):
+        dirs = shard_dirs(shards_dir, index, count)
+        for kind, dst_dir in (("price", price_dir), ("final", final_dir), ("bloomberg", bloomberg_dir)):
+            src_dir = dirs[kind]
+            if not os.path.isdir(src_dir):
+                continue
+            for filename in sorted(os.listdir(src_dir)):
+                if is_tsv(filename):
+                    _copy_into(os.path.join(src_dir, filename), dst_dir)
+                    copied += 1
+
+    print(f"Merged {count} shards ({copied} files) into: {bloomberg_dir}")